@@ -3,128 +3,312 @@
 CEC Test Tool - CEC Controller Module
 Handles CEC commands and prevents command looping
 """
+import selectors
 import subprocess
+import threading
 import time
 import logging
+import logging.handlers
 import os
+import queue
+import atexit
+import concurrent.futures
+import re
+from collections import namedtuple
 
-# Set up logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("cec_control.log"),
-        logging.StreamHandler()
-    ]
-)
 logger = logging.getLogger("cec_control")
 
 # Anti-looping protection
 COMMAND_COOLDOWN = 2.0  # seconds
-last_command_time = 0
+COMMAND_COOLDOWN_NS = int(COMMAND_COOLDOWN * 1_000_000_000)
+RATE_LIMITED_RESPONSE = "Rate limited. Please wait before sending another command."
+next_command_ns = 0  # monotonic time the next command is allowed at
+rate_limit_lock = threading.Lock()
+
+# cec-client start-up: it prints this once the adapter is open
+CEC_READY_MARKER = b"waiting for input"
+CEC_INIT_TIMEOUT = 3.0  # seconds
+
+# Timeout and end-of-response markers for a command. The bus information
+# header is anchored to a line start so the preceding
+# "requesting CEC bus information ..." line doesn't end the read early
+CEC_RESPONSE_TIMEOUT = 8.0  # seconds
+CEC_RESPONSE_MARKERS = (b"\nCEC bus information", b"TRAFFIC:")
+
+# Pre-encoded stdin payloads for the commands this module sends itself
+CEC_COMMAND_PAYLOADS = {
+    command: (command + "\n").encode()
+    for command in ("scan", "on 0", "standby 0", "pow")
+}
+
+# Bus scans are slow (every logical address is polled), so the last result
+# is reused until it expires or a command may have changed the bus state
+SCAN_TTL = 30.0  # seconds
+scan_cache = {"time": 0.0, "response": None}
+scan_lock = threading.Lock()
+
+# Power status is cached briefly so bursts of UI refreshes share one query
+POWER_STATUS_TTL = 0.5  # seconds
+power_status_cache = {"time": 0.0, "response": None}
+
+# PowerStatus list parsed on demand, with the response it was parsed from
+parsed_power_status = {"response": None, "statuses": []}
+
+# Parsed power status of one device
+PowerStatus = namedtuple('PowerStatus', 'logical_addr power vendor osd_name')
+
+DEVICE_RE = re.compile(r"^device #(\d+)", re.M)
+POWER_STATUS_RE = re.compile(r"^power status:\s*(\S+)", re.M)
+VENDOR_RE = re.compile(r"^vendor:\s*(.+?)\s*$", re.M)
+OSD_NAME_RE = re.compile(r"^osd string:\s*(.+?)\s*$", re.M)
 
 # Global variable to store the cec-client process
 cec_process = None
 
+# Raw pipe descriptors of cec_process, written and read with os.write/os.read
+cec_stdin_fd = None
+cec_stdout_fd = None
+
+# A single worker thread owns the cec-client pipes. Commands from concurrent
+# callers (web requests, GPIO triggers) are queued to it and run one at a
+# time, so they never interleave commands and responses
+cec_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1,
+                                                     thread_name_prefix="cec")
+
+# Readiness notification for the cec-client stdout pipe
+cec_selector = selectors.DefaultSelector()
+
+def read_cec_output(markers, timeout):
+    """Read cec-client output until one of the markers appears or the timeout expires"""
+    # Sleep in the selector until cec-client actually writes something
+    response = bytearray()
+    scan_from = 0
+    overlap = max(len(marker) for marker in markers) - 1
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if not cec_selector.select(deadline - time.monotonic()):
+            continue
+        
+        chunk = os.read(cec_stdout_fd, 4096)
+        if not chunk:
+            # cec-client closed its output, it is restarted on the next command
+            break
+        response += chunk
+        
+        # Basic check if we've received a complete response, only searching the
+        # new bytes (plus enough overlap for a marker split across two reads)
+        if any(response.find(marker, scan_from) != -1 for marker in markers):
+            break
+        scan_from = max(0, len(response) - overlap)
+    
+    return response.decode('utf-8', 'replace')
+
+def drain_cec_stderr(stream):
+    """Read cec-client stderr until it is closed, logging each line"""
+    # Nothing else reads this pipe; once its buffer filled up, cec-client would
+    # block writing to it and every command would hang until it timed out
+    for line in iter(stream.readline, b""):
+        logger.debug("cec-client stderr: %s", line.decode('utf-8', 'replace').rstrip())
+
 def initialize_cec():
-    """Initialize a persistent CEC client connection"""
-    global cec_process
+    """Initialize a persistent CEC client connection (started on first use)"""
+    global cec_process, cec_stdin_fd, cec_stdout_fd
     try:
         if cec_process is None or cec_process.poll() is not None:
             logger.info("Starting persistent CEC client connection")
             cec_process = subprocess.Popen(['cec-client', '-d', '1'],
                                          stdin=subprocess.PIPE,
                                          stdout=subprocess.PIPE,
-                                         stderr=subprocess.PIPE,
-                                         universal_newlines=True)
-            time.sleep(2)  # Give it time to initialize
+                                         stderr=subprocess.PIPE)
+            cec_stdin_fd = cec_process.stdin.fileno()
+            cec_stdout_fd = cec_process.stdout.fileno()
+            threading.Thread(target=drain_cec_stderr,
+                             args=(cec_process.stderr,),
+                             daemon=True).start()
+
+            # Watch the new stdout pipe (dropping any pipe from a previous process)
+            # in non-blocking mode so responses are read as soon as they arrive
+            for key in list(cec_selector.get_map().values()):
+                cec_selector.unregister(key.fileobj)
+            os.set_blocking(cec_stdout_fd, False)
+            cec_selector.register(cec_process.stdout, selectors.EVENT_READ)
+
+            # Give it time to initialize, returning as soon as it is ready
+            banner = read_cec_output((CEC_READY_MARKER,), CEC_INIT_TIMEOUT)
+            if CEC_READY_MARKER.decode() not in banner:
+                logger.warning("cec-client did not report ready, continuing anyway")
         return True
     except Exception as e:
-        logger.error(f"Failed to initialize CEC client: {e}")
+        logger.error("Failed to initialize CEC client: %s", e)
         return False
 
-def execute_cec_command(command):
-    """Execute a CEC command using the persistent connection"""
+def run_cec_command(command):
+    """Write a command to cec-client and collect its response (worker thread only)"""
     global cec_process
     try:
         if not initialize_cec():
             return "Failed to initialize CEC client"
-            
-        logger.debug(f"Sending CEC command: {command}")
-        cec_process.stdin.write(command + "\n")
-        cec_process.stdin.flush()
         
+        logger.debug("Sending CEC command: %s", command)
+        payload = CEC_COMMAND_PAYLOADS.get(command) or (command + "\n").encode()
+        os.write(cec_stdin_fd, payload)
+    
         # Wait for response with a reasonable timeout
-        response = ""
-        start_time = time.time()
-        while time.time() - start_time < 8:  # 8-second timeout
-            line = cec_process.stdout.readline()
-            if line:
-                response += line
-            else:
-                time.sleep(0.1)
-                
-            # Basic check if we've received a complete response
-            if "CEC bus information" in response or "TRAFFIC:" in response:
-                break
-        
-        logger.debug(f"CEC response: {response}")
+        response = read_cec_output(CEC_RESPONSE_MARKERS, CEC_RESPONSE_TIMEOUT)
+    
+        logger.debug("CEC response: %s", response)
         return response
     except Exception as e:
-        logger.error(f"Error executing CEC command: {e}")
+        logger.error("Error executing CEC command: %s", e)
         # Try to reinitialize the connection on error
         initialize_cec()
         return f"Error: {str(e)}"
 
+def submit_cec_command(command):
+    """Queue a CEC command and return a Future for its response"""
+    return cec_executor.submit(run_cec_command, command)
+
+def execute_cec_command(command):
+    """Execute a CEC command using the persistent connection"""
+    return submit_cec_command(command).result()
+
 def is_rate_limited():
     """Check if we should rate limit commands to prevent looping"""
-    global last_command_time
-    current_time = time.time()
-    if current_time - last_command_time < COMMAND_COOLDOWN:
+    global next_command_ns
+    # Check and update under the lock so two threads can't both get through
+    with rate_limit_lock:
+        current_ns = time.monotonic_ns()
+        if current_ns < next_command_ns:
+            limited = True
+        else:
+            next_command_ns = current_ns + COMMAND_COOLDOWN_NS
+            limited = False
+    
+    if limited:
         logger.warning("Command rate limited to prevent looping")
-        return True
-    last_command_time = current_time
-    return False
+    return limited
 
-def scan_devices():
-    """Scan for CEC devices"""
-    logger.info("Scanning for CEC devices")
-    return execute_cec_command("scan")
+def invalidate_caches():
+    """Forget cached scan and power status results after a state change"""
+    scan_cache["response"] = None
+    power_status_cache["response"] = None
+
+def scan_devices(force=False):
+    """Scan for CEC devices, reusing a recent result unless force is set"""
+    # Concurrent callers wait for the scan in progress and share its result
+    with scan_lock:
+        if (not force and scan_cache["response"] is not None and
+                time.monotonic() - scan_cache["time"] < SCAN_TTL):
+            return scan_cache["response"]
+        
+        logger.info("Scanning for CEC devices")
+        response = execute_cec_command("scan")
+        
+        # Don't hold on to errors or timed-out scans; only a complete scan
+        # has the summary header, "requesting CEC bus information" comes first
+        if "\nCEC bus information" in response:
+            scan_cache.update(time=time.monotonic(), response=response)
+        return response
 
 def power_on():
     """Send power on command to all devices"""
     if is_rate_limited():
-        return "Rate limited. Please wait before sending another command."
+        return RATE_LIMITED_RESPONSE
     
     logger.info("Sending power ON command")
+    invalidate_caches()
     return execute_cec_command("on 0")
 
 def power_off():
     """Send power off command to all devices"""
     if is_rate_limited():
-        return "Rate limited. Please wait before sending another command."
+        return RATE_LIMITED_RESPONSE
     
     logger.info("Sending power OFF command")
+    invalidate_caches()
     return execute_cec_command("standby 0")
 
+def parse_power_status(response):
+    """Parse cec-client output into a list of PowerStatus tuples"""
+    # Split into per-device blocks when the output lists devices (as a scan does)
+    starts = [match.start() for match in DEVICE_RE.finditer(response)] or [0]
+    statuses = []
+    for start, end in zip(starts, starts[1:] + [len(response)]):
+        block = response[start:end]
+        power = POWER_STATUS_RE.search(block)
+        if power is None:
+            continue
+        
+        device = DEVICE_RE.match(block)
+        vendor = VENDOR_RE.search(block)
+        osd_name = OSD_NAME_RE.search(block)
+        statuses.append(PowerStatus(
+            int(device.group(1)) if device else None,
+            power.group(1),
+            vendor.group(1) if vendor else None,
+            osd_name.group(1) if osd_name else None))
+    
+    return statuses
+
 def get_power_status():
     """Get the power status of connected devices"""
+    if (power_status_cache["response"] is not None and
+            time.monotonic() - power_status_cache["time"] < POWER_STATUS_TTL):
+        return power_status_cache["response"]
+    
     logger.info("Getting power status")
-    return execute_cec_command("pow")
+    response = execute_cec_command("pow")
+    
+    # Don't hold on to errors or replies without a power status
+    if POWER_STATUS_RE.search(response):
+        power_status_cache.update(time=time.monotonic(), response=response)
+    return response
+
+def get_power_states(response=None):
+    """Get the power status of connected devices as PowerStatus tuples"""
+    # Callers that already hold a get_power_status() reply pass it in, so
+    # the tuples describe the same reply
+    if response is None:
+        response = get_power_status()
+    if parsed_power_status["response"] is not response:
+        parsed_power_status.update(response=response,
+                                   statuses=parse_power_status(response))
+    return parsed_power_status["statuses"]
 
 def send_custom_command(command):
     """Send a custom CEC command"""
     if is_rate_limited():
-        return "Rate limited. Please wait before sending another command."
+        return RATE_LIMITED_RESPONSE
     
-    logger.info(f"Sending custom command: {command}")
+    logger.info("Sending custom command: %s", command)
+    invalidate_caches()
     return execute_cec_command(command)
 
-# Initialize CEC connection when module is loaded
-initialize_cec()
+def setup_logging():
+    """Configure logging for the self-test, importers set up their own"""
+    # Records are queued by the calling thread and written to the log file
+    # and console in bulk by a background listener thread; the log file is
+    # rotated so it can't grow without bound on the SD card
+    log_queue = queue.SimpleQueue()
+    log_listener = logging.handlers.QueueListener(
+        log_queue,
+        logging.handlers.RotatingFileHandler("cec_control.log", maxBytes=1_000_000,
+                                             backupCount=3, delay=True),
+        logging.StreamHandler()
+    )
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.handlers.QueueHandler(log_queue)
+        ]
+    )
+    log_listener.start()
+    atexit.register(log_listener.stop)
 
 # Simple self-test when run directly
 if __name__ == "__main__":
+    setup_logging()
     print("CEC Controller Test")
     print("-----------------")
     print("Scanning for devices:")
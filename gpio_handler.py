@@ -1,72 +1,199 @@
 #!/usr/bin/env python3
 """
-Standalone GPIO Handler for CEC Test Tool
-Using lock file to prevent multiple instances
+GPIO Handler for CEC Test Tool
+Runs inside the web server or standalone, using a lock file to prevent
+multiple instances
 """
-import RPi.GPIO as GPIO
 import time
+import select
+from datetime import timedelta
 import logging
+import logging.handlers
 import os
-import json
-import subprocess
+import queue
 import sys
 import fcntl
 import signal
 import atexit
+import threading
+import mmap
+import struct
+import cec_control
+
+# libgpiod (v2) character device interface, preferred over RPi.GPIO when
+# installed
+try:
+    import gpiod
+    from gpiod.line import Bias, Direction, Edge
+except ImportError:
+    gpiod = None
+
+# RPi.GPIO, imported by setup_gpio() only once it falls back to it
+GPIO = None
 
-# Setup logging
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler()  # Log to console only to avoid permission issues
-    ]
-)
 logger = logging.getLogger("gpio_handler")
 
 # Lock file path
 LOCK_FILE = "/tmp/gpio_handler.lock"
+LOCK_ATTEMPTS = 5  # 0.5 s apart, for a previous instance to shut down
 
 # GPIO Pins
 POWER_ON_PIN = 17   # Physical pin 11
 POWER_OFF_PIN = 27  # Physical pin 13
 
-# Command file paths
-COMMAND_DIR = "/tmp/cec_commands"
-ON_COMMAND_FILE = os.path.join(COMMAND_DIR, "power_on_trigger")
-OFF_COMMAND_FILE = os.path.join(COMMAND_DIR, "power_off_trigger")
+# GPIO character device used with libgpiod
+GPIO_CHIP = "/dev/gpiochip0"
+
+# Debounce window the kernel applies to edges on libgpiod lines
+LINE_DEBOUNCE = timedelta(milliseconds=30)
+
+# Debounce window between accepted presses of the same button
+DEBOUNCE_NS = 200_000_000  # 200 ms
+
+# Edges closer together than this are contact bounce of a single press
+COALESCE_WINDOW = 0.05  # seconds
+
+# struct gpio_v2_line_event as read from a line request fd: timestamp_ns,
+# id, offset, seqno, line_seqno and padding
+LINE_EVENT = struct.Struct("=QIIII24x")
+LINE_EVENT_BATCH = 16  # events fetched per read()
+
+# Sampling periods when the kernel cannot deliver edge events for the pins:
+# idle sampling must stay shorter than the quickest press, right after a
+# level change the pins are sampled faster for POLL_ACTIVE_TICKS samples
+POLL_IDLE_MS = 100
+POLL_ACTIVE_MS = 20
+POLL_ACTIVE_TICKS = 50  # 1 s
+
+# BCM283x GPIO registers as mapped by /dev/gpiomem; GPLEV0 holds the input
+# level of pins 0-31 in a single word
+GPIOMEM_PATH = "/dev/gpiomem"
+GPLEV0_INDEX = 0x34 // 4
+BUTTON_MASK = (1 << POWER_ON_PIN) | (1 << POWER_OFF_PIN)
+
+# Realtime scheduling for the polling fallback's sampling, so Flask and OLED
+# work cannot delay a sample; best isolated from the scheduler on the kernel
+# cmdline with "isolcpus=3 nohz_full=3 rcu_nocbs=3"
+REALTIME_CPU = 3
+REALTIME_PRIORITY = 50  # SCHED_FIFO, needs LimitRTPRIO (see install.sh) or root
 
 # Global variables
 lock_file_handle = None
+gpio_backend = None  # "gpiod", "event" or "poll", picked once by setup_gpio()
+line_request = None  # libgpiod request for both button lines
+gpio_registers = None  # 32-bit view of /dev/gpiomem for the polling fallback
+
+# Button press counters, keyed by pin
+press_count = {POWER_ON_PIN: 0, POWER_OFF_PIN: 0}
+
+# Monotonic time of the last accepted press, only touched by the press thread
+last_press_ns = {pin: 0 for pin in press_count}
+
+# Monotonic deadline by which each pin's bounces have settled, watched by
+# the press thread
+pending_press = {pin: None for pin in press_count}
+press_cond = threading.Condition()
+press_thread = None
+
+# Accepted presses waiting for the trigger worker, oldest first; a trigger
+# already waiting is not queued twice, so this holds at most one per button
+pending_triggers = []
+trigger_cond = threading.Condition()
+trigger_thread = None
+
+# Set by stop_gpio_handler() or the SIGINT/SIGTERM handler to end the
+# monitoring loop
+stop_event = threading.Event()
+
+# Self-pipe that wakes the monitoring loop's blocking poll() for a stop
+# request; standalone, the signal module also writes it on every signal
+wakeup_read_fd = None
+wakeup_write_fd = None
+
+def apply_log_level():
+    """Set the root logger to the LOG_LEVEL environment variable, INFO if unset or unknown"""
+    # Called once logging is configured, so an unknown level can be reported
+    requested_level = (os.environ.get("LOG_LEVEL") or "INFO").upper()
+    if isinstance(logging.getLevelName(requested_level), int):
+        logging.getLogger().setLevel(requested_level)
+    else:
+        logging.getLogger().setLevel(logging.INFO)
+        logger.warning("Unknown LOG_LEVEL %r, logging at INFO", requested_level)
+
+def setup_logging():
+    """Configure console logging for the standalone handler process"""
+    # The button callbacks only queue records, a background listener
+    # thread does the console writes
+    log_queue = queue.SimpleQueue()
+    log_listener = logging.handlers.QueueListener(
+        log_queue,
+        logging.StreamHandler()  # Log to console only to avoid permission issues
+    )
+    logging.basicConfig(
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.handlers.QueueHandler(log_queue)
+        ]
+    )
+    log_listener.start()
+    atexit.register(log_listener.stop)
+    apply_log_level()
+
+def stop_previous_instance():
+    """Ask a standalone handler holding the lock file to exit"""
+    try:
+        with open(LOCK_FILE) as f:
+            pid = int(f.read().strip())
+        
+        # Never signal a web server that runs the handler in-process
+        with open("/proc/%d/cmdline" % pid, "rb") as f:
+            if b"gpio_handler.py" not in f.read():
+                logger.warning("Lock held by PID %d, which is not a standalone handler", pid)
+                return
+        
+        if pid != os.getpid():
+            logger.info("Stopping previous instance, PID %d", pid)
+            os.kill(pid, signal.SIGTERM)
+    except (OSError, ValueError) as e:
+        logger.warning("Could not stop previous instance: %s", e)
 
 def acquire_lock():
     """Try to acquire a lock file to ensure we're the only instance running"""
     global lock_file_handle
     
     try:
-        # Open the lock file
-        lock_file_handle = open(LOCK_FILE, 'w')
-        
-        # Try to get an exclusive lock (non-blocking)
-        fcntl.flock(lock_file_handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
-        
-        # Write our PID to the lock file
-        lock_file_handle.write(str(os.getpid()))
-        lock_file_handle.flush()
-        
-        logger.info(f"Lock acquired, PID {os.getpid()}")
-        return True
+        for attempt in range(LOCK_ATTEMPTS):
+            # Open without truncating, so a running instance's PID stays readable
+            lock_file_handle = open(LOCK_FILE, 'a+')
+            
+            # Try to get an exclusive lock (non-blocking)
+            try:
+                fcntl.flock(lock_file_handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # Another instance has the lock, stop it and try again
+                lock_file_handle.close()
+                lock_file_handle = None
+                if attempt == 0:
+                    stop_previous_instance()
+                time.sleep(0.5)
+                continue
+            
+            # Write our PID to the lock file
+            lock_file_handle.seek(0)
+            lock_file_handle.truncate()
+            lock_file_handle.write(str(os.getpid()))
+            lock_file_handle.flush()
+            
+            logger.info("Lock acquired, PID %d", os.getpid())
+            return True
         
-    except IOError:
-        # Another instance has the lock
         logger.error("Another instance is already running (lock file exists)")
-        if lock_file_handle:
-            lock_file_handle.close()
         return False
     except Exception as e:
-        logger.error(f"Lock acquisition error: {e}")
+        logger.error("Lock acquisition error: %s", e)
         if lock_file_handle:
             lock_file_handle.close()
+            lock_file_handle = None
         return False
 
 def release_lock():
@@ -78,42 +205,121 @@ def release_lock():
             # Release the lock and close the file
             fcntl.flock(lock_file_handle, fcntl.LOCK_UN)
             lock_file_handle.close()
+            lock_file_handle = None
             
             # Try to remove the lock file
             try:
-                os.remove(LOCK_FILE)
-            except:
+                os.unlink(LOCK_FILE)
+            except FileNotFoundError:
                 pass
                 
             logger.info("Lock released")
     except Exception as e:
-        logger.error(f"Error releasing lock: {e}")
+        logger.error("Error releasing lock: %s", e)
 
-def cleanup_and_exit(signal_num=None, frame=None):
-    """Clean up resources and exit"""
+def cleanup():
+    """Release the GPIO pins and the lock file, does nothing once released"""
+    global gpio_backend, line_request
+    
+    if gpio_backend is None and lock_file_handle is None:
+        return
+    
     logger.info("Cleaning up resources...")
     
     # Clean up GPIO
     try:
-        GPIO.cleanup()
+        if line_request is not None:
+            line_request.release()
+            line_request = None
+        elif gpio_backend is not None:
+            # Stop the edge callbacks before the pins are released
+            for pin in press_count:
+                GPIO.remove_event_detect(pin)
+            GPIO.cleanup()
     except:
         pass
+    gpio_backend = None
     
     # Release lock
     release_lock()
     
-    logger.info("Cleanup complete, exiting")
-    sys.exit(0)
+    logger.info("Cleanup complete")
+
+def request_stop(signal_num=None, frame=None):
+    """Signal handler - ask the monitoring loop to finish"""
+    stop_event.set()
+
+def stop_gpio_handler():
+    """Ask the monitoring loop to finish, callable from any thread"""
+    stop_event.set()
+    if wakeup_write_fd is not None:
+        try:
+            os.write(wakeup_write_fd, b"\0")
+        except BlockingIOError:
+            pass  # a wakeup is already pending
+
+def setup_wakeup_pipe():
+    """Create the pipe that wakes the monitoring loop for a stop request"""
+    global wakeup_read_fd, wakeup_write_fd
+    
+    if wakeup_read_fd is None:
+        wakeup_read_fd, wakeup_write_fd = os.pipe()
+        os.set_blocking(wakeup_read_fd, False)
+        os.set_blocking(wakeup_write_fd, False)
+
+def setup_signal_wakeup():
+    """Also wake the monitoring loop on signals (must be called from the main thread)"""
+    setup_wakeup_pipe()
+    signal.set_wakeup_fd(wakeup_write_fd)
 
 def setup_gpio():
-    """Set up GPIO pins"""
+    """Set up GPIO pins with the cheapest backend that works here"""
+    global gpio_backend, line_request, GPIO
+    
     try:
-        # First try to clean up
-        try:
-            GPIO.cleanup()
-        except:
-            pass
-            
+        if line_request is not None:
+            # Keep the lines from an earlier setup while the request is
+            # still healthy, re-requesting them costs a chip open and ioctls
+            try:
+                line_request.get_values()
+                return True
+            except OSError:
+                line_request.release()
+                line_request = None
+        
+        if gpiod is not None:
+            # Request both lines with kernel-side rising edge detection and debounce
+            try:
+                line_request = gpiod.request_lines(
+                    GPIO_CHIP,
+                    consumer="cec-test-tool",
+                    config={
+                        (POWER_ON_PIN, POWER_OFF_PIN): gpiod.LineSettings(
+                            direction=Direction.INPUT,
+                            bias=Bias.PULL_DOWN,
+                            edge_detection=Edge.RISING,
+                            debounce_period=LINE_DEBOUNCE)
+                    })
+                logger.info("GPIO lines requested from %s: ON=%d, OFF=%d", GPIO_CHIP, POWER_ON_PIN, POWER_OFF_PIN)
+                gpio_backend = "gpiod"
+                return True
+            except OSError as e:
+                # No access to the chip, lines busy or an old kernel
+                logger.warning("Cannot request lines from %s (%s), trying RPi.GPIO", GPIO_CHIP, e)
+        
+        # Release pins from an earlier successful setup before reconfiguring;
+        # RPi.GPIO only tracks this process's channels, so on first setup
+        # there is nothing to clean up
+        if gpio_backend in ("event", "poll"):
+            try:
+                GPIO.cleanup()
+            except RuntimeError:
+                pass
+            gpio_backend = None
+        
+        if GPIO is None:
+            import RPi.GPIO as GPIO
+        
         # Setup GPIO
         GPIO.setmode(GPIO.BCM)
         GPIO.setwarnings(False)
@@ -121,164 +327,280 @@ def setup_gpio():
         GPIO.setup(POWER_ON_PIN, GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
         GPIO.setup(POWER_OFF_PIN, GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
         
-        logger.info(f"GPIO pins configured: ON={POWER_ON_PIN}, OFF={POWER_OFF_PIN}")
-        return True
-    except Exception as e:
-        logger.error(f"GPIO setup failed: {e}")
-        return False
-
-def setup_command_dir():
-    """Set up command directory for inter-process communication"""
-    try:
-        # Create command directory if it doesn't exist
-        os.makedirs(COMMAND_DIR, exist_ok=True)
+        logger.info("GPIO pins configured: ON=%d, OFF=%d", POWER_ON_PIN, POWER_OFF_PIN)
         
-        # Clear any existing command files
-        if os.path.exists(ON_COMMAND_FILE):
-            os.remove(ON_COMMAND_FILE)
-        if os.path.exists(OFF_COMMAND_FILE):
-            os.remove(OFF_COMMAND_FILE)
-        
-        logger.info(f"Command directory setup at {COMMAND_DIR}")
+        # Let the kernel report rising edges instead of sampling the pins;
+        # RPi.GPIO calls us back from its own event thread
+        try:
+            for pin in press_count:
+                GPIO.add_event_detect(pin, GPIO.RISING,
+                                      callback=handle_button_press)
+            gpio_backend = "event"
+        except RuntimeError as e:
+            # Some kernels refuse RPi.GPIO edge detection, sample instead
+            logger.warning("Edge detection unavailable (%s), polling pins every %d ms",
+                           e, POLL_IDLE_MS)
+            for pin in press_count:
+                GPIO.remove_event_detect(pin)
+            map_gpio_registers()
+            gpio_backend = "poll"
         return True
     except Exception as e:
-        logger.error(f"Command directory setup failed: {e}")
+        logger.error("GPIO setup failed: %s", e)
         return False
 
 def trigger_power_on():
-    """Create a trigger file for power on"""
-    try:
-        # Write timestamp to trigger file
-        with open(ON_COMMAND_FILE, 'w') as f:
-            f.write(str(time.time()))
-        logger.info("Created power ON trigger file")
+    """Send the power on command"""
+    cec_control.power_on()
+
+def trigger_power_off():
+    """Send the power off command"""
+    cec_control.power_off()
+
+# Button dispatch table, keyed by pin: (label, trigger); the web server
+# replaces the triggers with its own to also update the OLED display
+BUTTON_ACTIONS = {
+    POWER_ON_PIN: ("ON", trigger_power_on),
+    POWER_OFF_PIN: ("OFF", trigger_power_off),
+}
+
+def trigger_worker():
+    """Run queued triggers one at a time, off the GPIO and press threads"""
+    while True:
+        with trigger_cond:
+            while not pending_triggers:
+                trigger_cond.wait()
+            trigger = pending_triggers.pop(0)
         
-        # Also execute the cec-client command directly as a backup
+        # Keep the only worker alive whatever a trigger raises
         try:
-            subprocess.run(['cec-client', '-s', '-d', '1', '-o', 'CEC_TEST', '-c', 'on 0'], 
-                          timeout=3, 
-                          stdout=subprocess.DEVNULL, 
-                          stderr=subprocess.DEVNULL)
-        except:
-            pass
-            
-    except Exception as e:
-        logger.error(f"Failed to create power ON trigger: {e}")
+            trigger()
+        except Exception:
+            logger.exception("Button trigger failed")
 
-def trigger_power_off():
-    """Create a trigger file for power off"""
-    try:
-        # Write timestamp to trigger file
-        with open(OFF_COMMAND_FILE, 'w') as f:
-            f.write(str(time.time()))
-        logger.info("Created power OFF trigger file")
+def queue_trigger(trigger):
+    """Hand a trigger to the worker thread, unless it is already waiting"""
+    with trigger_cond:
+        if trigger not in pending_triggers:
+            pending_triggers.append(trigger)
+            trigger_cond.notify()
+
+def debounce(channel):
+    """Return True if a press on this pin falls outside the debounce window"""
+    # Monotonic clock, so NTP stepping the wall clock at boot can't swallow presses
+    now = time.monotonic_ns()
+    if now - last_press_ns[channel] < DEBOUNCE_NS:
+        return False
+    last_press_ns[channel] = now
+    press_count[channel] += 1
+    return True
+
+def fire_button_press(channel):
+    """Handle one coalesced button press, runs on the press thread"""
+    if not debounce(channel):
+        return
+    
+    label, trigger = BUTTON_ACTIONS[channel]
+    logger.info("%s button pressed #%d", label, press_count[channel])
+    queue_trigger(trigger)
+
+def press_worker():
+    """Fire each pin's press once its coalescing window has passed"""
+    while True:
+        with press_cond:
+            while True:
+                now = time.monotonic()
+                due = [pin for pin, deadline in pending_press.items()
+                       if deadline is not None and deadline <= now]
+                if due:
+                    break
+                waiting = [deadline for deadline in pending_press.values() if deadline is not None]
+                press_cond.wait(min(waiting) - now if waiting else None)
+            for pin in due:
+                pending_press[pin] = None
         
-        # Also execute the cec-client command directly as a backup
+        for pin in due:
+            fire_button_press(pin)
+
+def handle_button_press(channel):
+    """Edge callback, runs on the monitoring loop or the RPi.GPIO event thread"""
+    # Push the pin's deadline back on every edge so a burst of bounces fires
+    # once, COALESCE_WINDOW after the last edge
+    with press_cond:
+        pending_press[channel] = time.monotonic() + COALESCE_WINDOW
+        press_cond.notify()
+
+def map_gpio_registers():
+    """Map the GPIO registers so both button levels come from one read"""
+    global gpio_registers
+    
+    try:
+        fd = os.open(GPIOMEM_PATH, os.O_RDONLY | os.O_SYNC)
         try:
-            subprocess.run(['cec-client', '-s', '-d', '1', '-o', 'CEC_TEST', '-c', 'standby 0'], 
-                          timeout=3, 
-                          stdout=subprocess.DEVNULL, 
-                          stderr=subprocess.DEVNULL)
-        except:
-            pass
-            
-    except Exception as e:
-        logger.error(f"Failed to create power OFF trigger: {e}")
+            registers = mmap.mmap(fd, mmap.PAGESIZE, mmap.MAP_SHARED, mmap.PROT_READ)
+        finally:
+            os.close(fd)
+        # Indexing a uint32 view is a single aligned load of the register
+        gpio_registers = memoryview(registers).cast("I")
+    except (OSError, ValueError) as e:
+        logger.warning("Cannot map %s (%s), reading pins through RPi.GPIO", GPIOMEM_PATH, e)
+        gpio_registers = None
+
+def read_button_levels():
+    """Return the button pin levels as a bitmask keyed by pin number"""
+    if gpio_registers is not None:
+        return gpio_registers[GPLEV0_INDEX] & BUTTON_MASK
+    
+    levels = 0
+    for pin in press_count:
+        if GPIO.input(pin):
+            levels |= 1 << pin
+    return levels
+
+def set_realtime_scheduling():
+    """Give the calling thread SCHED_FIFO priority and pin it to REALTIME_CPU"""
+    # pid 0 means the calling thread, not the whole process
+    try:
+        os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(REALTIME_PRIORITY))
+    except (AttributeError, OSError) as e:
+        logger.info("Realtime scheduling not available, using the default: %s", e)
+        return
+    
+    # Only pin once the policy change worked, a normal thread is better
+    # off wherever the scheduler puts it
+    try:
+        if REALTIME_CPU in os.sched_getaffinity(0):
+            os.sched_setaffinity(0, {REALTIME_CPU})
+    except OSError as e:
+        logger.info("Cannot pin GPIO polling to CPU %d: %s", REALTIME_CPU, e)
+    logger.info("GPIO polling runs with SCHED_FIFO priority %d", REALTIME_PRIORITY)
 
 def gpio_monitoring_loop():
     """Monitor GPIO pins for button presses"""
     logger.info("Starting GPIO monitoring loop")
     
-    # Button press counters
-    on_count = 0
-    off_count = 0
-    
-    # Track button states to detect changes
-    last_on_high = GPIO.input(POWER_ON_PIN) == 1
-    last_off_high = GPIO.input(POWER_OFF_PIN) == 1
-    
-    # Main loop
     try:
-        while True:
-            # Read current button states
-            on_is_high = GPIO.input(POWER_ON_PIN) == 1
-            off_is_high = GPIO.input(POWER_OFF_PIN) == 1
-            
-            # ON button handling - trigger only when it BECOMES high
-            if on_is_high and not last_on_high:
-                on_count += 1
-                logger.info(f"ON button pressed #{on_count}")
-                trigger_power_on()
-            
-            # OFF button handling - trigger only when it BECOMES high
-            if off_is_high and not last_off_high:
-                off_count += 1
-                logger.info(f"OFF button pressed #{off_count}")
-                trigger_power_off()
-            
-            # Update button states
-            last_on_high = on_is_high
-            last_off_high = off_is_high
+        poller = select.poll()
+        poll_timeout = None  # block until an event, unless sampling the pins
+        if wakeup_read_fd is not None:
+            poller.register(wakeup_read_fd, select.POLLIN)
+        
+        logger.info("Using %s GPIO backend", gpio_backend)
+        if gpio_backend == "gpiod":
+            # The request fd turns readable once the kernel has queued edge
+            # events; read them in batches straight into a reused buffer and
+            # dispatch each of them by line offset
+            poller.register(line_request.fd, select.POLLIN)
+            event_buffer = bytearray(LINE_EVENT.size * LINE_EVENT_BATCH)
+            event_view = memoryview(event_buffer)
+        elif gpio_backend == "poll":
+            # Only sampling has deadlines, with edge events this thread just
+            # waits in poll() and the press work runs on other threads
+            set_realtime_scheduling()
+            poll_timeout = POLL_IDLE_MS
+            active_ticks = 0
+            last_levels = read_button_levels()
+        
+        # With edge events nothing in this process wakes up while the buttons
+        # are idle, the loop only runs for edge events and signals
+        while not stop_event.is_set():
+            for fd, _ in poller.poll(poll_timeout):
+                if fd == wakeup_read_fd:
+                    os.read(wakeup_read_fd, 512)
+                else:
+                    size = os.readv(fd, [event_buffer])
+                    for _, _, offset, _, _ in LINE_EVENT.iter_unpack(event_view[:size]):
+                        handle_button_press(offset)
             
-            # Brief delay
-            time.sleep(0.1)
+            if poll_timeout is not None:
+                # Both pins are packed in one word, a single mask finds every
+                # rising edge since the previous sample
+                levels = read_button_levels()
+                rising = levels & ~last_levels
+                if levels != last_levels:
+                    active_ticks = POLL_ACTIVE_TICKS
+                elif active_ticks:
+                    active_ticks -= 1
+                last_levels = levels
+                if rising:
+                    for pin in press_count:
+                        if rising & (1 << pin):
+                            handle_button_press(pin)
+                
+                # Sample fast while a button is in use, slowly when idle
+                poll_timeout = POLL_ACTIVE_MS if active_ticks else POLL_IDLE_MS
             
     except Exception as e:
-        logger.error(f"Error in monitoring loop: {e}")
+        logger.error("Error in monitoring loop: %s", e)
         return False
         
     return True
 
-def start_gpio_handler():
-    """Main entry point for GPIO handler"""
-    logger.info("Starting standalone GPIO handler")
-    
-    # Set up signal handlers for clean exit
-    signal.signal(signal.SIGINT, cleanup_and_exit)  # Ctrl+C
-    signal.signal(signal.SIGTERM, cleanup_and_exit)  # termination
-    atexit.register(cleanup_and_exit)  # Normal exit
+def run_gpio_handler():
+    """Set up the buttons and monitor them until stopped, from any thread"""
+    global trigger_thread, press_thread
     
     # Try to acquire lock
     if not acquire_lock():
-        logger.error("Cannot acquire lock, exiting")
-        sys.exit(1)
+        logger.error("Cannot acquire lock, GPIO handler not started")
+        return False
     
     # Set up GPIO pins
     retry_count = 0
     while retry_count < 3:
         if setup_gpio():
             break
-        logger.info(f"GPIO setup failed, retrying ({retry_count+1}/3)...")
+        logger.info("GPIO setup failed, retrying (%d/3)...", retry_count + 1)
         time.sleep(2)
         retry_count += 1
     
     if retry_count >= 3:
         logger.error("Failed to set up GPIO after multiple attempts")
-        cleanup_and_exit()
+        cleanup()
+        return False
     
-    # Set up command directory
-    if not setup_command_dir():
-        logger.error("Failed to set up command directory")
-        cleanup_and_exit()
+    # CEC commands take a while, run triggers on their own thread, away from
+    # the GPIO and press threads
+    if trigger_thread is None:
+        trigger_thread = threading.Thread(target=trigger_worker, name="trigger", daemon=True)
+        trigger_thread.start()
+    if press_thread is None:
+        press_thread = threading.Thread(target=press_worker, name="press", daemon=True)
+        press_thread.start()
     
     # Start monitoring loop
     logger.info("Starting GPIO monitoring")
+    setup_wakeup_pipe()
     try:
         gpio_monitoring_loop()
-    except KeyboardInterrupt:
-        logger.info("Stopped by user")
     except Exception as e:
-        logger.error(f"Fatal error: {e}")
+        logger.error("Fatal error: %s", e)
     
     # Clean up
-    cleanup_and_exit()
+    cleanup()
+    return True
+
+def start_gpio_handler():
+    """Main entry point for the standalone GPIO handler"""
+    logger.info("Starting standalone GPIO handler")
+    
+    # Set up signal handlers for clean exit; they only stop the monitoring
+    # loop, cleanup then runs from the main code path below
+    setup_signal_wakeup()
+    signal.signal(signal.SIGINT, request_stop)  # Ctrl+C
+    signal.signal(signal.SIGTERM, request_stop)  # termination
+    atexit.register(cleanup)  # Normal exit
+    
+    if not run_gpio_handler():
+        sys.exit(1)
 
 # Run the GPIO handler when the script is executed directly
 if __name__ == "__main__":
+    setup_logging()
     try:
         start_gpio_handler()
     except Exception as e:
-        logger.error(f"Unhandled exception: {e}")
+        logger.error("Unhandled exception: %s", e)
     finally:
         # Make sure we clean up
-        cleanup_and_exit()
+        cleanup()
@@ -53,7 +53,7 @@ source $INSTALL_DIR/venv/bin/activate
 
 # Install Python dependencies in the virtual environment
 echo "Installing Python dependencies..."
-pip install flask adafruit-circuitpython-ssd1306 pillow RPi.GPIO
+pip install flask waitress adafruit-circuitpython-ssd1306 pillow RPi.GPIO gpiod
 
 # Get the current non-root user (usually the user who ran sudo)
 CURRENT_USER=$(logname || who -m | awk '{print $1}')
@@ -76,6 +76,8 @@ WorkingDirectory=$INSTALL_DIR
 Restart=always
 User=${USER_TO_SETUP}
 Group=${GROUP_TO_SETUP}
+# Lets the GPIO polling fallback use SCHED_FIFO without running as root
+LimitRTPRIO=50
 
 [Install]
 WantedBy=multi-user.target
@@ -5,21 +5,15 @@ Handles the small OLED display connected to the Raspberry Pi
 """
 import time
 import logging
-import threading
+import logging.handlers
+import queue
+import atexit
+import concurrent.futures
 import board
 import busio
 import adafruit_ssd1306
 from PIL import Image, ImageDraw, ImageFont
 
-# Set up logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("oled_display.log"),
-        logging.StreamHandler()
-    ]
-)
 logger = logging.getLogger("oled_display")
 
 # Configuration for the OLED display
@@ -34,11 +28,31 @@ draw = None
 image = None
 font = None
 font_large = None
-display_lock = threading.Lock()
+status_template = None
+
+# All drawing and I2C transfers run on this single worker, so callers never
+# wait on the bus and updates can't interleave
+display_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="oled")
+
+# SSD1306 commands used for partial updates
+SET_COL_ADDR = 0x21
+SET_PAGE_ADDR = 0x22
+
+# Framebuffer as last sent to the panel, to find the pages that changed
+sent_buffer = None
+
+# Finished status screens keyed by (title, status); the screens the tool
+# shows are a small fixed set, so each is rendered only once
+status_frames = {}
+PRERENDERED_STATUSES = [
+    ("Starting...", "CEC Test Tool"),
+    ("Command sent:", "POWER ON"),
+    ("Command sent:", "POWER OFF"),
+]
 
 def initialize_display():
     """Initialize the OLED display"""
-    global display, draw, image, font, font_large
+    global display, draw, image, font, font_large, status_template
     
     try:
         # Create the I2C interface
@@ -65,76 +79,169 @@ def initialize_display():
             font = ImageFont.load_default()
             font_large = ImageFont.load_default()
         
+        # The header and separator are the same on every status screen
+        status_template = Image.new("1", (display.width, display.height))
+        template_draw = ImageDraw.Draw(status_template)
+        template_draw.text((0, 0), "CEC Test Tool", font=font_large, fill=255)
+        template_draw.line((0, 18, display.width, 18), fill=255)
+        
+        # Render the fixed screens now, so showing them later is only a blit
+        for title, status in PRERENDERED_STATUSES:
+            status_frames[(title, status)] = render_status(title, status)
+        
         logger.info("OLED display initialized")
         return True
     
     except Exception as e:
-        logger.error(f"Failed to initialize OLED display: {e}")
+        logger.error("Failed to initialize OLED display: %s", e)
         return False
 
+def log_display_error(future):
+    """Log an exception raised by a queued display update"""
+    error = future.exception()
+    if error is not None:
+        logger.error("Display update failed: %s", error)
+
+def submit_display_update(update, *args):
+    """Queue a display update on the display worker and return its Future"""
+    future = display_executor.submit(update, *args)
+    future.add_done_callback(log_display_error)
+    return future
+
+def draw_clear():
+    """Blank the display (display worker only)"""
+    if display is None:
+        return
+    
+    draw.rectangle((0, 0, display.width, display.height), outline=0, fill=0)
+    update_display()
+
+def draw_text(text, x, y, large_font):
+    """Draw text over the current screen (display worker only)"""
+    if display is None:
+        return
+    
+    selected_font = font_large if large_font else font
+    draw.text((x, y), text, font=selected_font, fill=255)
+    update_display()
+
 def clear_display():
     """Clear the display"""
-    with display_lock:
-        if display is None:
-            return
-        
-        draw.rectangle((0, 0, display.width, display.height), outline=0, fill=0)
-        update_display()
+    return submit_display_update(draw_clear)
 
 def show_text(text, x=0, y=0, large_font=False):
     """Show text on the display at the specified position"""
-    with display_lock:
-        if display is None:
-            return
-        
-        selected_font = font_large if large_font else font
-        draw.text((x, y), text, font=selected_font, fill=255)
-        update_display()
+    return submit_display_update(draw_text, text, x, y, large_font)
+
+def render_status(title, status):
+    """Draw a status screen with title and status into a new image"""
+    frame = status_template.copy()
+    frame_draw = ImageDraw.Draw(frame)
+    frame_draw.text((0, 22), title, font=font, fill=255)
+    frame_draw.text((0, 36), status, font=font_large, fill=255)
+    return frame
+
+def draw_status(title, status):
+    """Put a status screen on the display (display worker only)"""
+    if display is None:
+        return
+    
+    frame = status_frames.get((title, status))
+    if frame is None:
+        frame = render_status(title, status)
+        status_frames[(title, status)] = frame
+    
+    # Copy into the working image so show_text can still draw on top
+    image.paste(frame)
+    update_display()
 
 def show_status(title, status):
     """Show a status screen with title and status"""
-    with display_lock:
-        if display is None:
-            return
-        
-        clear_display()
-        draw.text((0, 0), "CEC Test Tool", font=font_large, fill=255)
-        draw.line((0, 18, display.width, 18), fill=255)
-        draw.text((0, 22), title, font=font, fill=255)
-        draw.text((0, 36), status, font=font_large, fill=255)
-        update_display()
+    return submit_display_update(draw_status, title, status)
+
+def pack_image(img, buffer):
+    """Pack a mode "1" image into the SSD1306 page layout of buffer[1:]"""
+    # Transposed and mirrored, each image row packs one display column into
+    # one byte per page, lowest page last and top pixel in the low bit; PIL
+    # does that in C instead of the driver's per-pixel Python loop
+    columns = img.transpose(Image.TRANSPOSE).transpose(Image.FLIP_LEFT_RIGHT).tobytes()
+    width = img.width
+    pages = img.height // 8
+    for page in range(pages):
+        buffer[1 + page * width:1 + (page + 1) * width] = columns[pages - 1 - page::pages]
 
 def update_display():
     """Update the physical display with the current image"""
+    global sent_buffer
+    
     if display is None:
         return
     
-    display.image(image)
-    display.show()
+    pack_image(image, display.buffer)
+    frame = display.buffer[1:]  # skips the I2C data control byte
+    if sent_buffer is None:
+        display.show()
+        sent_buffer = frame
+        return
+    
+    # Send only the 8-pixel-high pages that changed, as one transfer
+    # covering the first to the last dirty page
+    width = display.width
+    dirty = [page for page in range(display.pages)
+             if frame[page * width:(page + 1) * width] != sent_buffer[page * width:(page + 1) * width]]
+    if dirty:
+        first, last = dirty[0], dirty[-1]
+        for cmd in (SET_COL_ADDR, 0, width - 1, SET_PAGE_ADDR, first, last):
+            display.write_cmd(cmd)
+        with display.i2c_device:
+            display.i2c_device.write(b"\x40" + frame[first * width:(last + 1) * width])
+    sent_buffer = frame
 
 def show_power_on():
     """Show that power on was activated"""
-    show_status("Command sent:", "POWER ON")
+    return show_status("Command sent:", "POWER ON")
 
 def show_power_off():
     """Show that power off was activated"""
-    show_status("Command sent:", "POWER OFF")
+    return show_status("Command sent:", "POWER OFF")
 
 def show_ip_address(ip_address):
     """Show the IP address of the Raspberry Pi"""
-    show_status("Web Interface:", ip_address)
+    return show_status("Web Interface:", ip_address)
 
 def cleanup():
     """Clean up display resources"""
-    with display_lock:
-        if display is None:
-            return
-        
-        clear_display()
-        logger.info("OLED display resources cleaned up")
+    if display is None:
+        return
+    
+    # Runs after any updates still queued, wait so the panel ends up blank
+    clear_display().result()
+    logger.info("OLED display resources cleaned up")
+
+def setup_logging():
+    """Configure logging for the self-test, importers set up their own"""
+    # Records are queued by the calling thread and written to the log file
+    # and console by a background listener thread
+    log_queue = queue.SimpleQueue()
+    log_listener = logging.handlers.QueueListener(
+        log_queue,
+        logging.handlers.RotatingFileHandler("oled_display.log", maxBytes=1_000_000,
+                                             backupCount=3, delay=True),
+        logging.StreamHandler()
+    )
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.handlers.QueueHandler(log_queue)
+        ]
+    )
+    log_listener.start()
+    atexit.register(log_listener.stop)
 
 # Test the display when run directly
 if __name__ == "__main__":
+    setup_logging()
     if initialize_display():
         try:
             show_status("OLED Test", "Working!")
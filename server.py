@@ -1,97 +1,138 @@
 #!/usr/bin/env python3
 """
 CEC Test Tool - Web Server
-Modified to work with standalone GPIO handler
+Runs the GPIO button handler in-process
 """
-import os
 import logging
+import logging.handlers
 import json
+import os
+import queue
+import atexit
 import socket
 import threading
 import time
-import subprocess
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Response, request, jsonify
 import cec_control
 import oled_display
-
-# Set up logging
+import gpio_handler
+
+# waitress serves requests from a thread pool; the Flask development
+# server is only used when it is not installed
+try:
+    from waitress import serve
+except ImportError:
+    serve = None
+
+# Set up logging - request and button threads only queue records, a
+# background listener thread writes the rotated log file and the console
+log_queue = queue.SimpleQueue()
+log_listener = logging.handlers.QueueListener(
+    log_queue,
+    logging.handlers.RotatingFileHandler("server.log", maxBytes=1_000_000,
+                                         backupCount=3, delay=True),
+    logging.StreamHandler()
+)
 logging.basicConfig(
-    level=logging.DEBUG,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
     handlers=[
-        logging.FileHandler("server.log"),
-        logging.StreamHandler()
+        logging.handlers.QueueHandler(log_queue)
     ]
 )
+log_listener.start()
+atexit.register(log_listener.stop)
+gpio_handler.apply_log_level()
 
 logger = logging.getLogger("server")
 
 # Create Flask app
 app = Flask(__name__, static_folder="web_gui", static_url_path='')
 
+# The main page only changes on deploy, so it is read once at startup
+with open(os.path.join(app.static_folder, 'index.html'), 'rb') as index_file:
+    INDEX_HTML = index_file.read()
+
+# Request threads; CEC commands are still serialized by cec_control's worker
+WEB_THREADS = 8
+
 # Initialize hardware
 oled_initialized = False
-gpio_handler_process = None
-
-# Command file paths
-COMMAND_DIR = "/tmp/cec_commands"
-ON_COMMAND_FILE = os.path.join(COMMAND_DIR, "power_on_trigger")
-OFF_COMMAND_FILE = os.path.join(COMMAND_DIR, "power_off_trigger")
+gpio_thread = None
 
-# Last processed command times
-last_processed = {
-    'on': 0,
-    'off': 0
-}
+# Outbound IP address, once it could be determined
+ip_address_cache = None
 
-def get_ip_address():
+def get_ip_address(refresh=False):
     """Get the IP address of the Raspberry Pi"""
+    global ip_address_cache
+    
+    # The address is stable, route lookup only once unless asked to refresh
+    if ip_address_cache is not None and not refresh:
+        return ip_address_cache
+    
     try:
-        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        s.connect(("8.8.8.8", 80))
-        ip_address = s.getsockname()[0]
-        s.close()
-        return ip_address
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+            s.connect(("8.8.8.8", 80))
+            ip_address_cache = s.getsockname()[0]
+        return ip_address_cache
     except Exception as e:
-        logger.error(f"Error getting IP address: {e}")
+        # Not cached, the network may just not be up yet
+        logger.error("Error getting IP address: %s", e)
         return "127.0.0.1"  # Fallback to localhost
 
+def success_response(result, **fields):
+    """Build the JSON success response around a result, without jsonify"""
+    body = '{"status": "success", "result": %s' % json.dumps(result)
+    for name, value in fields.items():
+        body += ', "%s": %s' % (name, json.dumps(value))
+    return Response(body + '}', mimetype='application/json')
+
 @app.route('/')
 def index():
     """Serve the main web interface"""
-    return send_from_directory(app.static_folder, 'index.html')
+    return Response(INDEX_HTML, mimetype='text/html',
+                    headers={'Cache-Control': 'public, max-age=60'})
 
 @app.route('/api/scan', methods=['GET'])
 def scan_devices():
     """API endpoint to scan for CEC devices"""
     result = cec_control.scan_devices()
-    return jsonify({'status': 'success', 'result': result})
+    return success_response(result)
 
-@app.route('/api/power/on', methods=['POST'])
-def power_on():
-    """API endpoint to power on devices"""
-    result = cec_control.power_on()
-    
-    if oled_initialized:
-        oled_display.show_power_on()
-    
-    return jsonify({'status': 'success', 'result': result})
+# Power actions by name: the CEC command and the OLED screen confirming it
+POWER_ACTIONS = {
+    'on': (cec_control.power_on, oled_display.show_power_on),
+    'off': (cec_control.power_off, oled_display.show_power_off),
+}
 
-@app.route('/api/power/off', methods=['POST'])
-def power_off():
-    """API endpoint to power off devices"""
-    result = cec_control.power_off()
+def run_power_action(action):
+    """Send a power command and show it on the OLED, shared by routes and buttons"""
+    command, show_screen = POWER_ACTIONS[action]
+    result = command()
     
-    if oled_initialized:
-        oled_display.show_power_off()
+    # A rate-limited command was never sent, keep the screen as it is
+    if oled_initialized and result != cec_control.RATE_LIMITED_RESPONSE:
+        show_screen()
     
-    return jsonify({'status': 'success', 'result': result})
+    return result
+
+def power(action):
+    """API endpoint to power devices on or off"""
+    result = run_power_action(action)
+    return success_response(result)
+
+# One fixed URL per action rather than a converter, so the URL map, and how
+# it answers other methods, stays what the separate routes had
+for power_action in POWER_ACTIONS:
+    app.add_url_rule('/api/power/' + power_action, endpoint='power_' + power_action,
+                     view_func=power, methods=['POST'], defaults={'action': power_action})
 
 @app.route('/api/status', methods=['GET'])
 def get_status():
-    """API endpoint to get the power status"""
+    """API endpoint to get the power status, raw and parsed per device"""
     result = cec_control.get_power_status()
-    return jsonify({'status': 'success', 'result': result})
+    devices = [status._asdict() for status in cec_control.get_power_states(result)]
+    return success_response(result, devices=devices)
 
 @app.route('/api/command', methods=['POST'])
 def custom_command():
@@ -101,112 +142,35 @@ def custom_command():
         return jsonify({'status': 'error', 'message': 'Command is required'}), 400
     
     result = cec_control.send_custom_command(data['command'])
-    return jsonify({'status': 'success', 'result': result})
+    return success_response(result)
 
-def check_command_files():
-    """Check for command trigger files and process them"""
-    global last_processed
-    
-    # Check ON command file
-    if os.path.exists(ON_COMMAND_FILE):
-        try:
-            # Read timestamp from file
-            with open(ON_COMMAND_FILE, 'r') as f:
-                timestamp = float(f.read().strip())
-            
-            # Check if this is a new command
-            if timestamp > last_processed['on']:
-                logger.info(f"Processing power ON command from GPIO handler")
-                cec_control.power_on()
-                last_processed['on'] = timestamp
-                
-                # Show on OLED if available
-                if oled_initialized:
-                    oled_display.show_power_on()
-            
-            # Remove the trigger file
-            os.remove(ON_COMMAND_FILE)
-            
-        except Exception as e:
-            logger.error(f"Error processing ON command file: {e}")
-    
-    # Check OFF command file
-    if os.path.exists(OFF_COMMAND_FILE):
-        try:
-            # Read timestamp from file
-            with open(OFF_COMMAND_FILE, 'r') as f:
-                timestamp = float(f.read().strip())
-            
-            # Check if this is a new command
-            if timestamp > last_processed['off']:
-                logger.info(f"Processing power OFF command from GPIO handler")
-                cec_control.power_off()
-                last_processed['off'] = timestamp
-                
-                # Show on OLED if available
-                if oled_initialized:
-                    oled_display.show_power_off()
-            
-            # Remove the trigger file
-            os.remove(OFF_COMMAND_FILE)
-            
-        except Exception as e:
-            logger.error(f"Error processing OFF command file: {e}")
+def button_power_on():
+    """Power on button trigger, runs on the GPIO handler's trigger thread"""
+    logger.info("Processing power ON command from GPIO button")
+    run_power_action('on')
 
-def command_monitor_thread():
-    """Thread to monitor for command files from the GPIO handler"""
-    logger.info("Starting command monitor thread")
-    
-    # Create command directory if it doesn't exist
-    try:
-        os.makedirs(COMMAND_DIR, exist_ok=True)
-    except Exception as e:
-        logger.error(f"Failed to create command directory: {e}")
-    
-    # Main monitoring loop
-    while True:
-        try:
-            # Check for command files
-            check_command_files()
-            
-            # Sleep briefly
-            time.sleep(0.1)
-            
-        except Exception as e:
-            logger.error(f"Error in command monitor thread: {e}")
-            time.sleep(1)
+def button_power_off():
+    """Power off button trigger, runs on the GPIO handler's trigger thread"""
+    logger.info("Processing power OFF command from GPIO button")
+    run_power_action('off')
+
+def run_gpio_thread():
+    """GPIO thread body, the web interface keeps running without the buttons"""
+    if not gpio_handler.run_gpio_handler():
+        logger.warning("GPIO handler could not start, buttons will not work")
 
 def start_gpio_handler():
-    """Start the GPIO handler as a separate Python process"""
-    global gpio_handler_process
+    """Run the GPIO button handler on a thread of this process"""
+    global gpio_thread
     
-    try:
-        # Check if script exists
-        handler_script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "gpio_handler.py")
-        if not os.path.exists(handler_script):
-            logger.error(f"GPIO handler script not found at {handler_script}")
-            return False
-        
-        # Make sure it's executable
-        os.chmod(handler_script, 0o755)
-        
-        # Start the process
-        logger.info(f"Starting GPIO handler process: {handler_script}")
-        gpio_handler_process = subprocess.Popen(["python3", handler_script], 
-                                               stdout=subprocess.PIPE, 
-                                               stderr=subprocess.PIPE)
-        
-        # Check if process started successfully
-        if gpio_handler_process.poll() is None:
-            logger.info("GPIO handler process started successfully")
-            return True
-        else:
-            logger.error("GPIO handler process failed to start")
-            return False
-            
-    except Exception as e:
-        logger.error(f"Error starting GPIO handler: {e}")
-        return False
+    # Button presses call cec_control directly, sharing our cec-client session
+    gpio_handler.BUTTON_ACTIONS[gpio_handler.POWER_ON_PIN] = ("ON", button_power_on)
+    gpio_handler.BUTTON_ACTIONS[gpio_handler.POWER_OFF_PIN] = ("OFF", button_power_off)
+    
+    gpio_thread = threading.Thread(target=run_gpio_thread,
+                                   name="gpio", daemon=True)
+    gpio_thread.start()
+    return gpio_thread.is_alive()
 
 def initialize_hardware():
     """Initialize hardware components"""
@@ -223,22 +187,14 @@ def initialize_hardware():
         else:
             logger.warning("Failed to initialize OLED display")
     except Exception as e:
-        logger.error(f"OLED display error: {e}")
+        logger.error("OLED display error: %s", e)
         oled_initialized = False
     
-    # Start GPIO handler as separate process
-    if not start_gpio_handler():
-        logger.warning("Failed to start GPIO handler process, buttons may not work")
-    
-    # Start command monitor thread
-    monitor_thread = threading.Thread(target=command_monitor_thread)
-    monitor_thread.daemon = True
-    monitor_thread.start()
-    
-    if monitor_thread.is_alive():
-        logger.info("Command monitor thread started successfully")
+    # Start the GPIO handler
+    if start_gpio_handler():
+        logger.info("GPIO handler thread started successfully")
     else:
-        logger.error("Failed to start command monitor thread")
+        logger.warning("Failed to start GPIO handler, buttons may not work")
 
 if __name__ == '__main__':
     try:
@@ -247,22 +203,24 @@ if __name__ == '__main__':
         
         # Start the web server
         ip_address = get_ip_address()
-        logger.info(f"Starting web server on http://{ip_address}:5000")
-        app.run(host='0.0.0.0', port=5000, debug=False)
+        logger.info("Starting web server on http://%s:5000", ip_address)
+        if serve is not None:
+            serve(app, host='0.0.0.0', port=5000, threads=WEB_THREADS)
+        else:
+            logger.warning("waitress not installed, using the Flask development server")
+            app.run(host='0.0.0.0', port=5000, debug=False, threaded=True)
         
     except KeyboardInterrupt:
         logger.info("Server stopped by user")
     except Exception as e:
-        logger.error(f"Server error: {e}")
+        logger.error("Server error: %s", e)
     finally:
         # Clean up resources
         if oled_initialized:
             oled_display.cleanup()
         
-        # Terminate GPIO handler process if running
-        if gpio_handler_process and gpio_handler_process.poll() is None:
-            try:
-                gpio_handler_process.terminate()
-                logger.info("GPIO handler process terminated")
-            except:
-                pass
+        # Stop the GPIO handler and release its pins
+        if gpio_thread is not None:
+            gpio_handler.stop_gpio_handler()
+            gpio_thread.join(timeout=2)
+            logger.info("GPIO handler stopped")